@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Count the MongoDB commands behind each `get_public_confessions` call.
+
+Seeds a scratch database on a local mongod, warms `server.hot_feed`, then
+calls the feed handler for every page shape the API serves while a pymongo
+`CommandListener` records each command sent to the scratch database. Every
+shape has a budget (0 for pages served from the hot feed, 1 for a keyset
+page, one more for `include_totals`); the run fails if any call issues more
+commands than that, so a count, a debug dump or an N+1 lookup that creeps
+back into the feed path shows up here first. Mean latency per shape is
+printed alongside.
+
+Usage:
+    python bench_feed_queries.py [--mongo-url mongodb://localhost:27017] [--docs 2000] [--calls 50]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+DEFAULT_MONGO_URL = "mongodb://localhost:27017"
+# Driver housekeeping, not something the handler asked for
+IGNORED_COMMANDS = {"endSessions", "hello", "isMaster", "ismaster", "ping"}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to one database"""
+
+    def __init__(self, database: str):
+        self.database = database
+        self.commands = []
+
+    def started(self, event):
+        if event.database_name == self.database and event.command_name not in IGNORED_COMMANDS:
+            self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed(db, docs: int):
+    now = datetime.utcnow()
+    await db.confessions.insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "tx_id": f"tx-{i}",
+            "content": f"confession {i}",
+            "author": f"user{i % 50}",
+            "timestamp": now - timedelta(minutes=i),
+            "is_public": True,
+            "moderation": {"approved": True},
+            "mood": "neutral",
+            "tags": [],
+            "upvotes": random.randint(0, 500),
+            "downvotes": 0,
+            "reply_count": random.randint(0, 50),
+            "view_count": 0,
+        }
+        for i in range(docs)
+    ])
+
+
+async def main_async(args, counter: CommandCounter):
+    import server
+
+    db = server.db
+    failures = []
+    try:
+        print(f"🌱 Seeding {args.docs} confessions")
+        await seed(db, args.docs)
+        await server.ensure_indexes()
+        await server.seed_confession_totals()
+        await server.hot_feed.warm()
+
+        async def cursor_after(**kwargs):
+            page = await server.get_public_confessions(limit=args.limit, **kwargs)
+            return page["next_cursor"]
+
+        shapes = [
+            ("hot feed, first page", {}, 0),
+            ("hot feed, next page", {"cursor": await cursor_after()}, 0),
+            ("hot feed with totals", {"include_totals": True}, 1),
+            ("past the hot feed (offset)", {"offset": server.HOT_FEED_SIZE}, 1),
+            ("timestamp asc", {"order": "asc"}, 1),
+            ("upvotes desc", {"sort_by": "upvotes"}, 1),
+            ("upvotes desc, next page", {"sort_by": "upvotes", "cursor": await cursor_after(sort_by="upvotes")}, 1),
+            ("reply_count asc", {"sort_by": "reply_count", "order": "asc"}, 1),
+            ("upvotes desc with totals", {"sort_by": "upvotes", "include_totals": True}, 2),
+        ]
+
+        print(f"🔍 {args.calls} calls per page shape, limit {args.limit}")
+        for name, kwargs, budget in shapes:
+            counts, latencies = [], []
+            for _ in range(args.calls):
+                counter.commands.clear()
+                started = time.perf_counter()
+                await server.get_public_confessions(limit=args.limit, **kwargs)
+                latencies.append(time.perf_counter() - started)
+                counts.append(len(counter.commands))
+            worst = max(counts)
+            ok = worst <= budget
+            if not ok:
+                failures.append(name)
+            print(f"  {'✅' if ok else '❌'} {name:<28} {worst} commands (budget {budget})  "
+                  f"mean {statistics.mean(latencies) * 1000:6.2f} ms"
+                  + ("" if ok else f"  {', '.join(counter.commands)}"))
+    finally:
+        if not args.keep:
+            await server.client.drop_database(args.db)
+        server.client.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how many Mongo commands each feed page costs")
+    parser.add_argument("--mongo-url", default=DEFAULT_MONGO_URL, help="local mongod to use (never point this at production)")
+    parser.add_argument("--db", default=f"feed_bench_{os.getpid()}", help="scratch database name")
+    parser.add_argument("--docs", type=int, default=2000, help="confessions to seed")
+    parser.add_argument("--calls", type=int, default=50, help="calls per page shape")
+    parser.add_argument("--limit", type=int, default=20, help="confessions per page")
+    parser.add_argument("--keep", action="store_true", help="leave the scratch database in place")
+    args = parser.parse_args()
+
+    # server.py reads its connection settings at import time, and listeners
+    # only attach to clients created after they are registered
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db
+    counter = CommandCounter(args.db)
+    monitoring.register(counter)
+    failures = asyncio.run(main_async(args, counter))
+    if failures:
+        print(f"❌ Over budget: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ Every feed page stayed within its query budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Measure event-loop lag while a burst of logins verifies bcrypt hashes.
+
+A ticker coroutine sleeps for a fixed interval and records how late it wakes
+up; anything beyond a millisecond or two is time the loop spent unable to
+serve other requests or WebSocket frames. The burst runs twice: once with
+`verify_password` called inline (the old login path) and once through
+`server.password_hasher`, which also reports how many attempts it shed.
+
+Usage:
+    python bench_password_hashing.py [--logins 50] [--rounds 12] [--max-pending 64]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+
+async def ticker(interval: float, lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def burst(name, login, logins: int, interval: float):
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(interval, lags, stop))
+    await asyncio.sleep(interval * 2)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+
+    ok = sum(result is True for result in results)
+    shed = sum(isinstance(result, Exception) for result in results)
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(f"  {name:<8} {logins / elapsed:>6.1f} logins/s  ({ok} verified, {shed} shed in {elapsed:.2f}s)  "
+          f"loop lag median {statistics.median(lags_ms):.1f} ms, p99 {p99:.1f} ms, max {lags_ms[-1]:.1f} ms")
+
+
+async def main_async(args):
+    import server
+
+    password = "correct horse battery staple"
+    password_hash = server.get_password_hash(password)
+    hasher = server.PasswordHasher(args.workers or server.BCRYPT_WORKERS, args.max_pending)
+
+    async def inline_login():
+        return server.verify_password(password, password_hash)
+
+    async def offloaded_login():
+        valid, _ = await hasher.verify_and_update(password, password_hash)
+        return valid
+
+    print(f"🔐 {args.logins} concurrent logins, bcrypt cost {server.BCRYPT_ROUNDS}, "
+          f"{hasher.workers} hashing threads, ticker every {args.interval * 1000:.0f} ms")
+    try:
+        await burst("inline", inline_login, args.logins, args.interval)
+        await burst("executor", offloaded_login, args.logins, args.interval)
+    finally:
+        hasher.close()
+    print(f"  hasher stats: {hasher.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare event-loop lag for inline and offloaded bcrypt")
+    parser.add_argument("--logins", type=int, default=50, help="logins in the burst")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=0, help="hashing threads (0 = CPU count)")
+    parser.add_argument("--max-pending", type=int, default=64, help="queued verifications before shedding")
+    parser.add_argument("--interval", type=float, default=0.005, help="ticker interval in seconds")
+    args = parser.parse_args()
+
+    # server.py reads its settings at import time; the benchmark never touches Mongo
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "bench")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
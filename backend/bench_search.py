@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark `/api/search` with the in-process BM25 index against the `$text` path.
+
+Seeds a scratch database on a local mongod with generated confessions,
+builds `server.search_index` from it, then runs the same text queries
+through both search paths and prints latency percentiles, how often the
+index's top hits overlap the `$text` results, and what a snapshot costs to
+write and to load on restart.
+
+Usage:
+    python bench_search.py [--mongo-url mongodb://localhost:27017] [--docs 20000] [--queries 200]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+DEFAULT_MONGO_URL = "mongodb://localhost:27017"
+WORDS = (
+    "work boss deadline family mother father sister brother love crush breakup school exam teacher "
+    "friend lonely anxious happy tired sleep coffee money rent secret guilty proud scared dream "
+    "moving city job interview promotion quit party wedding birthday dog cat gym diet health"
+).split()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+async def seed(db, docs: int):
+    now = datetime.utcnow()
+    batch = []
+    for i in range(docs):
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "content": " ".join(random.choices(WORDS, k=random.randint(8, 60))),
+            "tags": random.sample(WORDS, 2),
+            "mood": random.choice(["happy", "sad", "anxious", "excited", "neutral"]),
+            "author": f"user{i % 200}",
+            "timestamp": now - timedelta(minutes=i),
+            "is_public": True,
+            "moderation": {"approved": True},
+            "upvotes": random.randint(0, 100),
+            "reply_count": random.randint(0, 20),
+        })
+        if len(batch) == 1000:
+            await db.confessions.insert_many(batch)
+            batch = []
+    if batch:
+        await db.confessions.insert_many(batch)
+
+
+async def timed(coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    return time.perf_counter() - started, result
+
+
+async def main_async(args):
+    import server
+
+    db = server.db
+    try:
+        print(f"🌱 Seeding {args.docs} confessions")
+        await seed(db, args.docs)
+        await server.ensure_indexes()
+
+        elapsed, _ = await timed(server.search_index.rebuild())
+        print(f"🔎 Index built in {elapsed:.2f}s: {server.search_index.stats()}")
+
+        queries = [" ".join(random.sample(WORDS, random.randint(1, 3))) for _ in range(args.queries)]
+        text_latencies, index_latencies, overlaps = [], [], []
+        for query in queries:
+            request = server.SearchRequest(query=query, sort_by="timestamp", limit=args.limit)
+            elapsed, text_result = await timed(server.search_with_mongo(request, query))
+            text_latencies.append(elapsed)
+            request = server.SearchRequest(query=query, sort_by="relevance", limit=args.limit)
+            elapsed, index_result = await timed(server.search_with_index(request, query))
+            index_latencies.append(elapsed)
+            text_ids = {doc["id"] for doc in text_result["confessions"]}
+            if index_result["confessions"]:
+                overlaps.append(sum(doc["id"] in text_ids for doc in index_result["confessions"]) / len(index_result["confessions"]))
+
+        for name, latencies in (("$text", text_latencies), ("bm25", index_latencies)):
+            print(f"  {name:<6} p50 {percentile(latencies, 0.5):7.2f} ms  p95 {percentile(latencies, 0.95):7.2f} ms  "
+                  f"mean {statistics.mean(latencies) * 1000:7.2f} ms")
+        if overlaps:
+            print(f"  top-{args.limit} overlap with $text (recency-ordered): {statistics.mean(overlaps):.0%}")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "search_index.snapshot")
+            elapsed, _ = await timed(server.search_index.save_snapshot(path))
+            print(f"💾 Snapshot written in {elapsed:.2f}s ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+            restored = server.SearchIndex()
+            started = time.perf_counter()
+            restored.load_snapshot(path, max_age=3600)
+            print(f"📂 Snapshot mapped in {time.perf_counter() - started:.2f}s ({restored.live} documents)")
+    finally:
+        if not args.keep:
+            await server.client.drop_database(args.db)
+        server.client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BM25 index search with Mongo $text search")
+    parser.add_argument("--mongo-url", default=DEFAULT_MONGO_URL, help="local mongod to use (never point this at production)")
+    parser.add_argument("--db", default=f"search_bench_{os.getpid()}", help="scratch database name")
+    parser.add_argument("--docs", type=int, default=20000, help="confessions to seed")
+    parser.add_argument("--queries", type=int, default=200, help="text queries to run through each path")
+    parser.add_argument("--limit", type=int, default=20, help="results per query")
+    parser.add_argument("--keep", action="store_true", help="leave the scratch database in place")
+    args = parser.parse_args()
+
+    # server.py reads its connection settings at import time
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark confession voting under concurrent clients hitting one confession.
+
+Runs the old multi-step vote sequence (find confession, find vote,
+insert/update vote, `$inc` counters), the current atomic path
+(`server.record_vote`) and the same path with sharded counters against a scratch database on a local mongod, then
+prints votes per second and checks that the stored counters still agree with
+the votes collection.
+
+Usage:
+    python bench_votes.py [--mongo-url mongodb://localhost:27017] [--clients 50] [--votes 20]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+
+DEFAULT_MONGO_URL = "mongodb://localhost:27017"
+
+
+async def legacy_vote(db, confession_id: str, user_identifier: str, vote_type: str):
+    """The vote path as it was before atomic upserts"""
+    confession = await db.confessions.find_one({"$or": [{"id": confession_id}, {"tx_id": confession_id}]})
+    existing_vote = await db.votes.find_one({"confession_id": confession["id"], "user_identifier": user_identifier})
+    if existing_vote:
+        if existing_vote["vote_type"] == vote_type:
+            return
+        await db.votes.update_one(
+            {"id": existing_vote["id"]},
+            {"$set": {"vote_type": vote_type, "timestamp": datetime.utcnow()}}
+        )
+        if existing_vote["vote_type"] == "upvote":
+            await db.confessions.update_one({"id": confession["id"]}, {"$inc": {"upvotes": -1, "downvotes": 1}})
+        else:
+            await db.confessions.update_one({"id": confession["id"]}, {"$inc": {"upvotes": 1, "downvotes": -1}})
+    else:
+        try:
+            await db.votes.insert_one({
+                "id": str(uuid.uuid4()),
+                "confession_id": confession["id"],
+                "user_identifier": user_identifier,
+                "vote_type": vote_type,
+                "timestamp": datetime.utcnow()
+            })
+        except Exception:
+            return
+        field = "upvotes" if vote_type == "upvote" else "downvotes"
+        await db.confessions.update_one({"id": confession["id"]}, {"$inc": {field: 1}})
+
+
+async def atomic_vote(server, confession_id: str, user_identifier: str, vote_type: str):
+    resolved_id = await server.resolve_confession_id(confession_id)
+    try:
+        await server.record_vote(
+            server.db.votes,
+            {"confession_id": resolved_id, "user_identifier": user_identifier},
+            vote_type,
+            lambda deltas, session: server.vote_counters.apply(resolved_id, user_identifier, deltas, session)
+        )
+    except server.DuplicateKeyError:
+        pass
+
+
+async def run(name, vote, server, clients: int, votes: int):
+    db = server.db
+    confession_id = str(uuid.uuid4())
+    await db.confessions.insert_one({"id": confession_id, "tx_id": f"tx-{confession_id}", "upvotes": 0, "downvotes": 0})
+
+    async def client(index: int):
+        voter = f"voter-{index}"
+        for i in range(votes):
+            # Flip-flop, with an occasional repeat, so every branch gets exercised
+            vote_type = "upvote" if (i // 2 + index) % 2 == 0 else "downvote"
+            await vote(confession_id, voter, vote_type)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(clients)))
+    elapsed = time.perf_counter() - started
+    # Fold any sharded counts back in before comparing
+    await server.vote_counters.rollup()
+
+    doc = await db.confessions.find_one({"id": confession_id})
+    upvotes = await db.votes.count_documents({"confession_id": confession_id, "vote_type": "upvote"})
+    downvotes = await db.votes.count_documents({"confession_id": confession_id, "vote_type": "downvote"})
+    consistent = doc.get("upvotes") == upvotes and doc.get("downvotes") == downvotes
+    total = clients * votes
+    print(f"  {name:<7} {total / elapsed:>8.0f} votes/s  ({total} votes in {elapsed:.2f}s)  "
+          f"counters {doc.get('upvotes')}/{doc.get('downvotes')} vs votes {upvotes}/{downvotes} "
+          f"{'✅' if consistent else '❌ drifted'}")
+
+
+async def main_async(args):
+    import server
+
+    db = server.db
+    await db.votes.create_index([("confession_id", 1), ("user_identifier", 1)], unique=True)
+    await db.confessions.create_index([("id", 1)], unique=True)
+    await db.confessions.create_index([("tx_id", 1)])
+    try:
+        print(f"🗳️  {args.clients} clients × {args.votes} votes on one confession")
+        await run("before", lambda *a: legacy_vote(db, *a), server, args.clients, args.votes)
+        server.COUNTER_SHARDING = False
+        await run("after", lambda *a: atomic_vote(server, *a), server, args.clients, args.votes)
+        # A zero threshold shards the confession from its first vote
+        server.COUNTER_SHARDING = True
+        server.vote_counters.threshold = 0
+        await run("sharded", lambda *a: atomic_vote(server, *a), server, args.clients, args.votes)
+    finally:
+        if not args.keep:
+            await server.client.drop_database(args.db)
+        server.client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and atomic vote paths")
+    parser.add_argument("--mongo-url", default=DEFAULT_MONGO_URL, help="local mongod to use (never point this at production)")
+    parser.add_argument("--db", default=f"vote_bench_{os.getpid()}", help="scratch database name")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent voters")
+    parser.add_argument("--votes", type=int, default=20, help="votes cast by each voter")
+    parser.add_argument("--keep", action="store_true", help="leave the scratch database in place")
+    args = parser.parse_args()
+
+    # server.py reads its connection settings at import time
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
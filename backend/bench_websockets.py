@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark WebSocket fan-out through `server.ConnectionManager`.
+
+Attaches simulated in-process sockets to a fresh manager (no network, no
+mongod needed), broadcasts a burst of messages and reports how long the
+broadcast calls take, how long until every healthy socket has received
+everything, and what happened to the slow and broken ones.
+
+Usage:
+    python bench_websockets.py [--connections 10000] [--messages 50] [--rate 4] [--slow 1] [--broken 1] [--policy drop_oldest]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+
+class SimulatedSocket:
+    """Stands in for a Starlette WebSocket: counts frames, optionally slow or broken"""
+
+    def __init__(self, delay: float = 0.0, broken: bool = False):
+        self.delay = delay
+        self.broken = broken
+        self.received = 0
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.broken:
+            raise ConnectionResetError("simulated dead socket")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+
+    async def close(self):
+        self.closed = True
+
+
+async def main_async(args):
+    import server
+
+    manager = server.ConnectionManager(args.queue_size, args.policy, args.send_timeout)
+    await server.event_bus.start(manager.deliver)
+    healthy, slow, broken = [], [], []
+    slow_count = args.connections * args.slow // 100
+    broken_count = args.connections * args.broken // 100
+    for index in range(args.connections):
+        if index < slow_count:
+            socket = SimulatedSocket(delay=args.slow_delay)
+            slow.append(socket)
+        elif index < slow_count + broken_count:
+            socket = SimulatedSocket(broken=True)
+            broken.append(socket)
+        else:
+            socket = SimulatedSocket()
+            healthy.append(socket)
+        await manager.connect(socket, f"user-{index % (args.connections // 2 or 1)}")
+
+    print(f"🔌 {args.connections} simulated sockets ({len(slow)} slow, {len(broken)} broken), policy={args.policy}")
+    payload = {"type": "counts_update", "counts": {f"confession-{i}": {"upvotes": i, "downvotes": 0, "reply_count": 0} for i in range(20)}}
+
+    started = time.perf_counter()
+    enqueue_elapsed = 0.0
+    for index in range(args.messages):
+        broadcast_started = time.perf_counter()
+        await manager.broadcast(json.dumps(payload))
+        enqueue_elapsed += time.perf_counter() - broadcast_started
+        # Pace the broadcasts; the writers run in between
+        await asyncio.sleep(max(0.0, started + (index + 1) / args.rate - time.perf_counter()))
+
+    # Wait for every healthy socket still attached to drain its queue
+    while any(
+        connection.queue.qsize()
+        for connection in (manager.connections.get(socket) for socket in healthy)
+        if connection is not None
+    ):
+        await asyncio.sleep(0.01)
+    delivered_elapsed = time.perf_counter() - started
+
+    frames = sum(socket.received for socket in healthy)
+    lossless = sum(socket.received == args.messages for socket in healthy)
+    print(f"  broadcast calls: {enqueue_elapsed * 1000:.1f} ms for {args.messages} messages "
+          f"({enqueue_elapsed / args.messages * 1000:.2f} ms each)")
+    print(f"  delivered:       {frames} frames to healthy sockets in {delivered_elapsed:.2f}s "
+          f"({frames / delivered_elapsed:,.0f} frames/s)")
+    print(f"  healthy sockets: {lossless}/{len(healthy)} received every message")
+    print(f"  slow sockets:    {sum(socket.received for socket in slow)} frames received so far")
+    print(f"  manager stats:   {manager.stats()}")
+    await manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive ConnectionManager with simulated sockets")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=50, help="broadcasts to send")
+    parser.add_argument("--rate", type=float, default=4, help="broadcasts per second (4 = one counts_update tick every 250 ms)")
+    parser.add_argument("--slow", type=int, default=1, help="percent of sockets that stall on every send")
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="seconds a slow socket takes per frame")
+    parser.add_argument("--broken", type=int, default=1, help="percent of sockets whose send raises")
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--policy", choices=["drop_oldest", "disconnect"], default="drop_oldest")
+    parser.add_argument("--send-timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    # server.py reads its connection settings at import time; the benchmark never touches Mongo
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "bench")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -135,7 +135,22 @@ class IrysService {
     }
 }
 
-// Main execution
+async function handleRequest(service, request) {
+    switch (request.action) {
+        case 'upload':
+            return await service.upload(request.data, request.tags || []);
+        case 'balance':
+            return await service.getBalance();
+        case 'address':
+            return await service.getAddress();
+        case 'ping':
+            return { success: true, initialized: service.initialized };
+        default:
+            return { success: false, error: 'Unknown action' };
+    }
+}
+
+// Main execution (one-shot: read a single request from stdin, answer, exit)
 async function main() {
     const service = new IrysService();
     
@@ -157,21 +172,7 @@ async function main() {
             }
 
             const request = JSON.parse(inputData);
-            let response;
-
-            switch (request.action) {
-                case 'upload':
-                    response = await service.upload(request.data, request.tags || []);
-                    break;
-                case 'balance':
-                    response = await service.getBalance();
-                    break;
-                case 'address':
-                    response = await service.getAddress();
-                    break;
-                default:
-                    response = { success: false, error: 'Unknown action' };
-            }
+            const response = await handleRequest(service, request);
 
             console.log(JSON.stringify(response));
         } catch (error) {
@@ -183,8 +184,58 @@ async function main() {
     });
 }
 
+// Sidecar execution (long-lived: newline-delimited JSON requests carrying an
+// "id", answered in any order with the same "id" on a single stdout line)
+async function serve() {
+    const readline = require('readline');
+    const service = new IrysService();
+
+    // stdout is reserved for protocol frames, so route diagnostics to stderr
+    const writeFrame = process.stdout.write.bind(process.stdout);
+    console.log = (...args) => console.error(...args);
+
+    const reply = (id, response) => {
+        writeFrame(JSON.stringify({ ...response, id }) + '\n');
+    };
+
+    // Initialize once up front; failed initialization is retried lazily per request
+    await service.initialize();
+    reply(null, { type: 'ready', success: service.initialized });
+
+    const rl = readline.createInterface({ input: process.stdin, terminal: false });
+
+    rl.on('line', async (line) => {
+        if (!line.trim()) {
+            return;
+        }
+
+        let request;
+        try {
+            request = JSON.parse(line);
+        } catch (error) {
+            reply(null, { success: false, error: 'Invalid JSON request' });
+            return;
+        }
+
+        try {
+            reply(request.id, await handleRequest(service, request));
+        } catch (error) {
+            reply(request.id, {
+                success: false,
+                error: error.message || 'Unknown error occurred'
+            });
+        }
+    });
+
+    rl.on('close', () => process.exit(0));
+}
+
 if (require.main === module) {
-    main();
+    if (process.argv.includes('--serve')) {
+        serve();
+    } else {
+        main();
+    }
 }
 
-module.exports = IrysService;
\ No newline at end of file
+module.exports = IrysService;
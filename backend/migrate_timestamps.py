@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Convert string `timestamp` fields to BSON dates, in place and online.
+
+Older confessions were stored with `isoformat() + 'Z'` strings and replies with
+naive ISO strings, which range queries on the `timestamp` index can't match.
+The migration walks each collection in `_id` order, converts documents in
+batches with `bulk_write`, and records a checkpoint after every batch so an
+interrupted run resumes where it stopped.
+
+Usage:
+    python migrate_timestamps.py [--batch-size 500] [--pause 0.2] [--dry-run] [--restart]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+COLLECTIONS = ["confessions", "replies"]
+
+
+def parse_iso_timestamp(value: str):
+    try:
+        return datetime.fromisoformat(value.strip().rstrip('Z'))
+    except ValueError:
+        return None
+
+
+def migrate_collection(db, name: str, batch_size: int, pause: float, dry_run: bool, restart: bool):
+    collection = db[name]
+    checkpoint_id = f"timestamps:{name}"
+    if restart:
+        db.migrations.delete_one({"_id": checkpoint_id})
+
+    checkpoint = db.migrations.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("done"):
+        print(f"  ✅ {name}: already migrated")
+        return
+
+    last_id = checkpoint.get("last_id")
+    converted = checkpoint.get("converted", 0)
+    skipped = checkpoint.get("skipped", 0)
+    remaining = collection.count_documents({"timestamp": {"$type": "string"}})
+    print(f"  🔄 {name}: {remaining} documents to convert" + (f" (resuming after {last_id})" if last_id else ""))
+
+    started = time.monotonic()
+    processed = 0
+    while True:
+        query = {"timestamp": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query, {"timestamp": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            parsed = parse_iso_timestamp(doc["timestamp"])
+            if parsed is None:
+                skipped += 1
+                continue
+            # Match on the original string so a concurrent rewrite of the field is never clobbered
+            operations.append(UpdateOne(
+                {"_id": doc["_id"], "timestamp": doc["timestamp"]},
+                {"$set": {"timestamp": parsed}}
+            ))
+
+        if operations and not dry_run:
+            result = collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        elif dry_run:
+            converted += len(operations)
+
+        last_id = batch[-1]["_id"]
+        processed += len(batch)
+        if not dry_run:
+            db.migrations.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {
+                    "last_id": last_id,
+                    "converted": converted,
+                    "skipped": skipped,
+                    "updated_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+
+        rate = processed / max(time.monotonic() - started, 1e-6)
+        print(f"     {name}: {processed}/{remaining} scanned, {converted} converted, {skipped} unparsable ({rate:.0f} docs/s)")
+
+        # Throttle so the migration doesn't starve live traffic
+        if pause:
+            time.sleep(pause)
+
+    if not dry_run:
+        db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"done": True, "converted": converted, "skipped": skipped, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    print(f"  ✅ {name}: {converted} converted, {skipped} left as unparsable strings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert string timestamps to BSON dates")
+    parser.add_argument("--batch-size", type=int, default=500, help="documents per bulk_write")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds to sleep between batches")
+    parser.add_argument("--collections", nargs="+", default=COLLECTIONS, choices=COLLECTIONS)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    print("🕒 Migrating timestamps to BSON dates" + (" (dry run)" if args.dry_run else ""))
+    try:
+        for name in args.collections:
+            migrate_collection(db, name, args.batch_size, args.pause, args.dry_run, args.restart)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted; rerun to resume from the last checkpoint")
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Check that every query shape the API issues is served by an index.
+
+Seeds a scratch database on a local mongod, builds the indexes declared in
+`server.INDEX_CATALOG`, then runs `explain()` on each endpoint's canonical
+query. The check fails if any winning plan contains a COLLSCAN or a blocking
+SORT stage, so a new query shape (or a changed filter) that outgrows the
+catalog shows up before it reaches production.
+
+Usage:
+    python verify_indexes.py [--mongo-url mongodb://localhost:27017] [--docs 2000] [--keep]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+DEFAULT_MONGO_URL = "mongodb://localhost:27017"
+BAD_STAGES = {"COLLSCAN", "SORT"}
+# Top-K sorts over an indexed time range: the SORT only ever holds `limit` documents
+BOUNDED_SORTS = {"trending board"}
+
+
+def seed(db, docs: int):
+    now = datetime.utcnow()
+    moods = ["happy", "sad", "angry", "anxious", "excited", "confused", "neutral"]
+    tags = ["work", "family", "love", "school", "health", "money"]
+    users = [{"id": str(uuid.uuid4()), "username": f"user{i}", "email": f"user{i}@example.com"} for i in range(50)]
+    db.users.insert_many([dict(user) for user in users])
+
+    confessions, replies, votes = [], [], []
+    for i in range(docs):
+        confession_id = str(uuid.uuid4())
+        approved = random.choice([True, True, True, False, None])
+        confessions.append({
+            "id": confession_id,
+            "tx_id": confession_id if i % 10 == 0 else f"tx-{confession_id}",
+            "content": f"seeded confession {i} about {random.choice(tags)}",
+            "is_public": i % 7 != 0,
+            "author": random.choice(users)["username"],
+            "mood": random.choice(moods),
+            "tags": random.sample(tags, 2),
+            "timestamp": now - timedelta(minutes=i),
+            "upvotes": random.randint(0, 100),
+            "reply_count": random.randint(0, 20),
+            "view_count": random.randint(0, 1000),
+            "trending_score": random.random() * 100,
+            "moderation": {} if approved is None else {"approved": approved},
+            "upload_state": random.choice(["uploaded", "uploaded", "pending"]),
+            "analysis_state": random.choice(["complete", "complete", "moderation", "enhancement"]),
+        })
+        for j in range(i % 3):
+            replies.append({
+                "id": str(uuid.uuid4()),
+                "confession_id": confession_id,
+                "tx_id": f"tx-reply-{i}-{j}",
+                "content": "seeded reply",
+                "timestamp": now - timedelta(minutes=i, seconds=j),
+            })
+        votes.append({"confession_id": confession_id, "user_identifier": random.choice(users)["id"], "vote_type": "upvote"})
+
+    db.confessions.insert_many(confessions)
+    db.replies.insert_many(replies)
+    db.votes.insert_many(votes)
+    db.reply_votes.insert_many([
+        {"reply_id": reply["id"], "user_identifier": random.choice(users)["id"], "vote_type": "upvote"}
+        for reply in replies[::5]
+    ])
+    db.upload_outbox.insert_many([
+        {
+            "confession_id": doc["id"],
+            "state": random.choice(["pending", "leased", "uploaded", "failed"]),
+            "next_attempt_at": now - timedelta(seconds=random.randint(-60, 600)),
+            "lease_expires_at": now - timedelta(seconds=random.randint(-60, 600)),
+        }
+        for doc in confessions[: docs // 4]
+    ])
+    db.confession_counters.insert_many([
+        {"_id": f"{doc['id']}:{shard}", "confession_id": doc["id"], "shard": shard,
+         "upvotes": random.randint(0, 5), "downvotes": 0, "dirty": shard % 2 == 0}
+        for doc in confessions[:20] for shard in range(8)
+    ])
+    db.analysis_cache.insert_many([
+        {"_id": f"key-{i}", "prompt_version": "v1", "created_at": now, "result": {}}
+        for i in range(100)
+    ])
+    return confessions, replies, users
+
+
+def canonical_queries(server, confessions, replies, users):
+    """(name, collection, filter, sort) for every query shape worth guarding"""
+    sample = next(doc for doc in confessions if doc["is_public"] and doc["moderation"].get("approved"))
+    reply = replies[0]
+    now = datetime.utcnow()
+    queries = [
+        ("confession by id or tx_id", "confessions", {"$or": [{"id": sample["id"]}, {"tx_id": sample["tx_id"]}]}, None),
+        ("confession by tx_id", "confessions", {"tx_id": sample["tx_id"]}, None),
+        ("reply by id", "replies", {"id": reply["id"]}, None),
+        ("reply by tx_id", "replies", {"tx_id": reply["tx_id"]}, None),
+        ("user by username", "users", {"username": users[0]["username"]}, None),
+        ("user by id", "users", {"id": users[0]["id"]}, None),
+        ("vote lookup", "votes", {"confession_id": sample["id"], "user_identifier": users[0]["id"]}, None),
+        ("reply vote lookup", "reply_votes", {"reply_id": reply["id"], "user_identifier": users[0]["id"]}, None),
+        ("trending board", "confessions", {**server.PUBLIC_FEED_QUERY, "timestamp": {"$gte": now - timedelta(hours=24)}}, [("trending_score", -1)]),
+        ("trending decay", "confessions", {"trending_score": {"$gt": 0}, "timestamp": {"$gte": now - timedelta(days=30)}}, None),
+        ("trending expiry", "confessions", {"trending_score": {"$gt": 0}, "$or": [{"timestamp": {"$lt": now - timedelta(days=30)}}, {"trending_score": {"$lt": 0.01}}]}, None),
+        ("search by date", "confessions", {**server.PUBLIC_FEED_QUERY, "timestamp": {"$gte": now - timedelta(days=7)}}, [("timestamp", -1)]),
+        ("search by author", "confessions", {**server.PUBLIC_FEED_QUERY, "author": users[0]["username"]}, [("timestamp", -1)]),
+        ("search by mood", "confessions", {**server.PUBLIC_FEED_QUERY, "mood": "happy"}, [("timestamp", -1)]),
+        ("confessions in last 24h", "confessions", {"timestamp": {"$gte": now - timedelta(hours=24)}}, None),
+        ("pending uploads", "confessions", {"upload_state": "pending"}, None),
+        ("interrupted analyses", "confessions", {"analysis_state": {"$in": ["moderation", "enhancement"]}}, None),
+        ("outbox claim", "upload_outbox", {"state": "pending", "next_attempt_at": {"$lte": now}}, [("next_attempt_at", 1)]),
+        ("outbox expired leases", "upload_outbox", {"state": "leased", "lease_expires_at": {"$lte": now}}, [("lease_expires_at", 1)]),
+        ("counter shard roll-up", "confession_counters", {"dirty": True, "claimed_at": None}, None),
+        ("counter shard stale claims", "confession_counters", {"claimed_at": {"$lte": now}}, None),
+        ("counter shard overlay", "confession_counters", {"confession_id": confessions[0]["id"], "dirty": True}, None),
+        ("analysis cache by version", "analysis_cache", {"prompt_version": {"$ne": "v2"}}, None),
+    ]
+
+    # Feed pages: the first page and a follow-up page for every sort and order
+    for sort_by in server.FEED_SORT_FIELDS:
+        for order in ("desc", "asc"):
+            query, sort = server.keyset_query(server.PUBLIC_FEED_QUERY, sort_by, order, None)
+            queries.append((f"feed {sort_by} {order}", "confessions", query, sort))
+            cursor = server.encode_cursor(sort_by, order, sample)
+            query, sort = server.keyset_query(server.PUBLIC_FEED_QUERY, sort_by, order, cursor)
+            queries.append((f"feed {sort_by} {order} (cursor)", "confessions", query, sort))
+
+    query, sort = server.keyset_query({"confession_id": reply["confession_id"]}, "timestamp", "asc", None)
+    queries.append(("replies page", "replies", query, sort))
+    cursor = server.encode_cursor("timestamp", "asc", reply)
+    query, sort = server.keyset_query({"confession_id": reply["confession_id"]}, "timestamp", "asc", cursor)
+    queries.append(("replies page (cursor)", "replies", query, sort))
+    return queries
+
+
+def plan_stages(plan):
+    """Yield every stage name in an explain plan tree"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+            if key in plan:
+                yield from plan_stages(plan[key])
+        for child in plan.get("inputStages", []):
+            yield from plan_stages(child)
+
+
+def explain(db, collection, query, sort):
+    cursor = db[collection].find(query).limit(50)
+    if sort:
+        cursor = cursor.sort(sort)
+    result = cursor.explain()
+    winning = result["queryPlanner"]["winningPlan"]
+    return set(plan_stages(winning))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain canonical queries against the declared index catalog")
+    parser.add_argument("--mongo-url", default=DEFAULT_MONGO_URL, help="local mongod to seed (never point this at production)")
+    parser.add_argument("--db", default=f"index_check_{os.getpid()}", help="scratch database name")
+    parser.add_argument("--docs", type=int, default=2000, help="confessions to seed")
+    parser.add_argument("--keep", action="store_true", help="leave the scratch database in place")
+    args = parser.parse_args()
+
+    # server.py reads its connection settings at import time
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db
+    import server
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db]
+    failures = []
+    try:
+        print(f"🌱 Seeding {args.db} with {args.docs} confessions")
+        confessions, replies, users = seed(db, args.docs)
+
+        failed = asyncio.run(server.ensure_indexes())
+        if failed:
+            print(f"  ❌ Could not create: {', '.join(failed)}")
+            failures.extend(failed)
+
+        print("🔍 Explaining canonical queries")
+        for name, collection, query, sort in canonical_queries(server, confessions, replies, users):
+            stages = explain(db, collection, query, sort)
+            bad = stages & (BAD_STAGES - {"SORT"} if name in BOUNDED_SORTS else BAD_STAGES)
+            if bad:
+                failures.append(name)
+                print(f"  ❌ {name}: {', '.join(sorted(bad))} in {', '.join(sorted(stages))}")
+            else:
+                print(f"  ✅ {name}: {', '.join(sorted(stages))}")
+    finally:
+        if not args.keep:
+            client.drop_database(args.db)
+        client.close()
+
+    if failures:
+        print(f"\n❌ {len(failures)} query shapes are not fully index-backed")
+        sys.exit(1)
+    print("\n✅ Every canonical query is served by an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Check that relevance-ranked search pages stay consistent while the index changes.
+
+Builds an in-memory `server.SearchIndex` from generated confessions, then
+walks a query page by page, indexing a burst of new matching confessions and
+hiding a few old ones before each of the first follow-up pages. Follow-up
+pages are scored with the corpus statistics captured on the first page, as
+`/api/search` does through its cursor. The check fails if a confession shows
+up twice, if a page ranks above the cursor it continues from, or if a
+confession that stayed visible throughout is never returned. The same walk
+with statistics recomputed on every page is printed alongside for
+comparison. No database is needed.
+
+Usage:
+    python verify_search_pagination.py [--docs 5000] [--limit 20] [--churn 200] [--churn-pages 10]
+"""
+
+import argparse
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+WORDS = (
+    "work boss deadline family mother father sister brother love crush breakup school exam teacher "
+    "friend lonely anxious happy tired sleep coffee money rent secret guilty proud scared dream"
+).split()
+
+
+def confession(now, minutes: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "content": " ".join(random.choices(WORDS, k=random.randint(8, 60))),
+        "tags": random.sample(WORDS, 2),
+        "mood": "neutral",
+        "author": "bench",
+        "timestamp": now - timedelta(minutes=minutes),
+        "is_public": True,
+        "moderation": {"approved": True},
+    }
+
+
+def walk(server, docs: list, query: str, limit: int, churn: int, churn_pages: int, frozen: bool, seed: int):
+    """Page through `query` while the index changes; return (seen, skipped, out_of_order)"""
+    random.seed(seed)
+    index = server.SearchIndex()
+    for doc in docs:
+        index.add(doc)
+    now = datetime.utcnow()
+
+    seen, out_of_order = [], 0
+    hidden = set()
+    after = stats = None
+    while True:
+        hits, _, _, page_stats = index.search(query, limit, after, stats=stats if frozen else None)
+        if after is not None and hits and hits[0] >= after:
+            out_of_order += 1
+        seen.extend(confession_id for _, confession_id in hits)
+        if len(hits) < limit:
+            break
+        after, stats = hits[-1], page_stats
+        if churn_pages <= 0:
+            continue
+        churn_pages -= 1
+
+        # New matching confessions shift document frequency, live count and average length
+        for i in range(churn):
+            doc = confession(now, -i)
+            doc["content"] = f"{query} {doc['content']}"
+            index.add(doc)
+        for confession_id in random.sample(list(index.docno), min(churn // 10, len(index.docno))):
+            hidden.add(confession_id)
+            index.discard(confession_id)
+
+    matching = {
+        doc["id"] for doc in docs
+        if query in server.search_terms(doc["content"]) + server.search_terms(" ".join(doc["tags"]))
+    }
+    return seen, matching - hidden - set(seen), out_of_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Page through BM25 search results while the index changes")
+    parser.add_argument("--docs", type=int, default=5000, help="confessions indexed before the first page")
+    parser.add_argument("--limit", type=int, default=20, help="results per page")
+    parser.add_argument("--churn", type=int, default=200, help="confessions indexed between pages (a tenth as many are hidden)")
+    parser.add_argument("--churn-pages", type=int, default=10, help="follow-up pages preceded by churn")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    args = parser.parse_args()
+
+    # server.py reads its settings at import time; the check never touches Mongo
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "search_pagination_check")
+    import server
+
+    random.seed(args.seed)
+    now = datetime.utcnow()
+    docs = [confession(now, i) for i in range(args.docs)]
+    query = random.choice(WORDS)
+
+    failures = []
+    print(f"🔎 Paging '{query}' over {args.docs} confessions, {args.churn} new matches before "
+          f"each of the first {args.churn_pages} follow-up pages")
+    for name, frozen in (("cursor stats", True), ("live stats", False)):
+        seen, skipped, out_of_order = walk(
+            server, docs, query, args.limit, args.churn, args.churn_pages, frozen, args.seed
+        )
+        duplicates = len(seen) - len(set(seen))
+        ok = not (duplicates or skipped or out_of_order)
+        print(f"  {'✅' if ok else '❌'} {name:<12} {len(seen)} results, {duplicates} duplicated, "
+              f"{len(skipped)} skipped, {out_of_order} pages out of order")
+        if frozen and not ok:
+            failures.append(name)
+
+    if failures:
+        print("❌ Relevance pages drifted while the index changed")
+        sys.exit(1)
+    print("✅ Relevance pages are stable while the index changes")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,7 @@ const SearchModal = ({ isOpen, onClose }) => {
     author: '',
     date_from: '',
     date_to: '',
-    sort_by: 'timestamp',
+    sort_by: 'relevance',
     order: 'desc'
   });
   const [loading, setLoading] = useState(false);
@@ -45,6 +45,7 @@ const SearchModal = ({ isOpen, onClose }) => {
   ];
 
   const sortOptions = [
+    { value: 'relevance', label: 'Best Match' },
     { value: 'timestamp', label: 'Most Recent' },
     { value: 'upvotes', label: 'Most Liked' },
     { value: 'reply_count', label: 'Most Replies' },
@@ -139,7 +140,7 @@ const SearchModal = ({ isOpen, onClose }) => {
       author: '',
       date_from: '',
       date_to: '',
-      sort_by: 'timestamp',
+      sort_by: 'relevance',
       order: 'desc'
     });
   };
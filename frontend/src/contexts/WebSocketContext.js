@@ -16,7 +16,7 @@ export const WebSocketProvider = ({ children }) => {
   const [connected, setConnected] = useState(false);
   const [liveUpdates, setLiveUpdates] = useState([]);
   const reconnectTimeoutRef = useRef(null);
-  const { user, isAuthenticated } = useAuth();
+  const { user, token, isAuthenticated } = useAuth();
 
   const connect = () => {
     if (socket?.readyState === WebSocket.OPEN) {
@@ -24,7 +24,9 @@ export const WebSocketProvider = ({ children }) => {
     }
 
     const userId = user?.id || 'anonymous';
-    const wsUrl = `${process.env.REACT_APP_BACKEND_URL.replace('http', 'ws')}/ws/${userId}`;
+    // The token proves the socket belongs to this user, so it may receive personal notifications
+    const query = user?.id && token ? `?token=${encodeURIComponent(token)}` : '';
+    const wsUrl = `${process.env.REACT_APP_BACKEND_URL.replace('http', 'ws')}/ws/${userId}${query}`;
     
     const ws = new WebSocket(wsUrl);
     
@@ -111,6 +113,16 @@ export const WebSocketProvider = ({ children }) => {
         }]);
         break;
         
+      case 'counts_update':
+        // Absolute totals for every confession whose counters changed this tick
+        setLiveUpdates(prev => [...prev, {
+          id: Date.now(),
+          type: 'counts',
+          data: data.counts,
+          timestamp: new Date()
+        }]);
+        break;
+        
       case 'crisis_support':
         setLiveUpdates(prev => [...prev, {
           id: Date.now(),
@@ -120,6 +132,10 @@ export const WebSocketProvider = ({ children }) => {
         }]);
         break;
         
+      case 'subscribed':
+      case 'unsubscribed':
+        break;
+        
       default:
         console.log('Unknown message type:', data.type);
     }
@@ -135,6 +151,16 @@ export const WebSocketProvider = ({ children }) => {
     }
   };
 
+  // Topics: 'feed:public', 'confession:<id>', 'tag:<tag>', 'user:<own id>'.
+  // New sockets start on 'feed:public' plus their own user topic.
+  const subscribe = (topics) => {
+    sendMessage({ type: 'subscribe', topics: [].concat(topics) });
+  };
+
+  const unsubscribe = (topics) => {
+    sendMessage({ type: 'unsubscribe', topics: [].concat(topics) });
+  };
+
   useEffect(() => {
     // Connect when component mounts
     connect();
@@ -143,7 +169,7 @@ export const WebSocketProvider = ({ children }) => {
     return () => {
       disconnect();
     };
-  }, [user?.id]);
+  }, [user?.id, token]);
 
   // Auto-clear old updates (keep only last 50)
   useEffect(() => {
@@ -159,7 +185,9 @@ export const WebSocketProvider = ({ children }) => {
     connect,
     disconnect,
     clearUpdates,
-    sendMessage
+    sendMessage,
+    subscribe,
+    unsubscribe
   };
 
   return (